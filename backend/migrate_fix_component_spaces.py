@@ -19,12 +19,13 @@ This script will:
 Make a backup before running on production data.
 """
 import os
-import re
 import sys
 import asyncio
 from pathlib import Path
 from dotenv import load_dotenv
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
 from datetime import datetime
 
 ROOT = Path(__file__).parent
@@ -34,30 +35,84 @@ MONGO_URL = os.environ.get('MONGO_URL')
 DB_NAME = os.environ.get('DB_NAME', 'site_renamer')
 UPLOADS_DIR = ROOT / 'uploads'
 
+# Maximum number of filename updates sent to MongoDB in a single bulk_write
+BULK_BATCH_SIZE = 100
+# Maximum number of sites processed concurrently
+SITE_CONCURRENCY = 32
+# Connection pool size; comfortably above SITE_CONCURRENCY so sites never wait on a socket
+MONGO_POOL_SIZE = 100
+
 if not MONGO_URL:
     print('MONGO_URL not set in backend/.env - aborting')
     sys.exit(1)
 
 
+def _ascii_table(allowed: bytes) -> bytes:
+    """Build a bytes.translate table that maps every byte not in `allowed` to '_'"""
+    allowed_set = set(allowed)
+    return bytes(c if c in allowed_set else ord('_') for c in range(256))
+
+
+_ALNUM = b'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+# Allowed characters in generated names (spaces are kept) / in filenames.
+# Non-ASCII characters are encoded as '?' first, which the tables map to '_'.
+_NAME_TABLE = _ascii_table(_ALNUM + b'_- ')
+_FNAME_TABLE = _ascii_table(_ALNUM + b' ._-')
+_COMPACT_TRANS = str.maketrans({' ': '_', '/': '_'})
+
+
 def apply_naming_format(format_str: str, site_id: str, category: str, component_name: str) -> str:
-    safe_site_id = site_id.replace(' ', '_')
-    safe_category = category.replace(' ', '_').replace('/', '_')
-    safe_component = component_name.replace('/', '_')
+    safe_site_id = site_id.translate(_COMPACT_TRANS)
+    safe_category = category.translate(_COMPACT_TRANS)
     result = format_str.replace('{site_id}', safe_site_id)
     result = result.replace('{category}', safe_category)
-    result = result.replace('{component_name}', safe_component)
-    result = re.sub(r'[^a-zA-Z0-9_\- ]', '_', result)
+    result = result.replace('{component_name}', component_name)
+    result = result.encode('ascii', 'replace').translate(_NAME_TABLE).decode('ascii')
     return result
 
 
 def _sanitize_filename(name: str) -> str:
     name = os.path.basename(name)
-    name = re.sub(r'[^a-zA-Z0-9 ._-]', '_', name)
+    name = name.encode('ascii', 'replace').translate(_FNAME_TABLE).decode('ascii')
     if name.startswith('.'):
         name = name.lstrip('.')
     return name or 'file'
 
 
+# Placeholder rendered in place of the component name to find the per-category
+# prefix/suffix of generated names. Only uses characters the sanitizers keep.
+_COMPONENT_SENTINEL = '__COMP__'
+
+
+def split_naming_format(format_str: str, site_id: str, category: str):
+    """Render the naming format around the component name once per category.
+
+    Returns (head, tail) so the expected name is head + sanitized component + tail,
+    or None when the split can't be trusted (callers then render each name in full).
+    """
+    rendered = apply_naming_format(format_str, site_id, category, _COMPONENT_SENTINEL)
+    parts = rendered.split(_COMPONENT_SENTINEL)
+    if len(parts) != 2:
+        return None
+    head, tail = parts
+    # Text around the placeholder can overlap the sentinel (e.g. a site id ending
+    # in '__COMP_'), which moves the split point; verify against an empty component.
+    if apply_naming_format(format_str, site_id, category, '') != head + tail:
+        return None
+    return head, tail
+
+
+def render_from_parts(name_parts, component_name: str) -> str:
+    """Sanitized base name for `component_name` from split_naming_format's (head, tail).
+
+    Equivalent to _sanitize_filename(apply_naming_format(...)): that output never
+    contains '/' or '.', so _sanitize_filename would only turn '' into 'file'.
+    """
+    head, tail = name_parts
+    safe_component = component_name.encode('ascii', 'replace').translate(_NAME_TABLE).decode('ascii')
+    return head + safe_component + tail or 'file'
+
+
 def unique_target(path: Path) -> Path:
     if not path.exists():
         return path
@@ -71,58 +126,137 @@ def unique_target(path: Path) -> Path:
         i += 1
 
 
-def main():
-    client = MongoClient(MONGO_URL)
-    db = client[DB_NAME]
-    sites = list(db.sites.find({}))
-    naming_cfg = db.naming_format.find_one({}, {"_id": 0})
-    format_str = naming_cfg.get('format') if naming_cfg else '{site_id}_{category}_{component_name}'
+async def flush_renames(db, ops: list, pending: list) -> int:
+    """Write the queued filename updates for files already renamed on disk.
 
+    `pending[i]` is the (old_path, new_path) rename behind `ops[i]`. Renames whose
+    update the server rejected are moved back so file and document agree again.
+    Returns the number of renames whose update was acknowledged.
+    """
+    if not ops:
+        return 0
+    failed = set()
+    try:
+        await db.sites.bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        failed = {err['index'] for err in e.details.get('writeErrors', [])}
+    except PyMongoError as e:
+        # Unknown which (if any) updates were applied, so don't touch the files;
+        # log both names so they can be reconciled by hand.
+        print(f"Bulk update failed ({e}); these files were renamed but their documents may still use the old name:")
+        for old_path, new_path in pending:
+            print(f"  {old_path} -> {new_path}")
+        return 0
+
+    renamed = 0
+    for i, (old_path, new_path) in enumerate(pending):
+        if i in failed:
+            try:
+                await asyncio.to_thread(new_path.rename, old_path)
+                print(f"Document update failed, reverted {new_path.name} -> {old_path.name}")
+            except Exception as e:
+                print(f"Document update failed and could not revert {new_path} -> {old_path}: {e}")
+            continue
+        renamed += 1
+        print(f"Renamed {old_path.name} -> {new_path.name}")
+    return renamed
+
+
+async def process_site(db, site, format_str: str, category_names_map: dict, sem: asyncio.Semaphore):
+    """Rename the files of a single site and update its document. Returns (total, renamed)."""
     total = 0
     renamed = 0
-    for site in sites:
-        site_id = site.get('site_id')
-        for cat in site.get('categories', []):
-            cat_key = cat.get('category')
-            # Fetch display category name if available
-            cat_doc = db.category_names.find_one({}, {"_id": 0})
-            if cat_doc and isinstance(cat_doc.get('categories', {}), dict):
-                display_category = cat_doc.get('categories', {}).get(cat_key, cat_key)
-            else:
-                display_category = cat_key
-
-            for img in cat.get('images', []):
-                total += 1
-                comp_name = img.get('component_name')
-                existing_fname = img.get('filename')
-                existing_path = UPLOADS_DIR / site_id / cat_key / existing_fname
-                if not existing_path.exists():
-                    print(f"Missing file: {existing_path}")
-                    continue
-
-                ext = Path(existing_fname).suffix
-                expected_base = apply_naming_format(format_str, site_id, display_category, comp_name)
-                expected_safe = _sanitize_filename(expected_base) + ext
-                if expected_safe == existing_fname:
-                    continue
-
-                target_path = UPLOADS_DIR / site_id / cat_key / expected_safe
-                target_path = unique_target(target_path)
-                try:
-                    existing_path.rename(target_path)
-                    # Update the document in MongoDB for this filename
-                    db.sites.update_one(
+    site_id = site.get('site_id')
+    ops = []
+    pending = []
+    async with sem:
+        try:
+            for cat in site.get('categories', []):
+                cat_key = cat.get('category')
+                display_category = category_names_map.get(cat_key, cat_key)
+                name_parts = split_naming_format(format_str, site_id, display_category)
+
+                for img in cat.get('images', []):
+                    total += 1
+                    comp_name = img.get('component_name')
+                    existing_fname = img.get('filename')
+                    existing_path = UPLOADS_DIR / site_id / cat_key / existing_fname
+                    if not existing_path.exists():
+                        print(f"Missing file: {existing_path}")
+                        continue
+
+                    ext = Path(existing_fname).suffix
+                    if name_parts:
+                        expected_safe = render_from_parts(name_parts, comp_name) + ext
+                    else:
+                        expected_base = apply_naming_format(format_str, site_id, display_category, comp_name)
+                        expected_safe = _sanitize_filename(expected_base) + ext
+                    if expected_safe == existing_fname:
+                        continue
+
+                    target_path = UPLOADS_DIR / site_id / cat_key / expected_safe
+                    target_path = unique_target(target_path)
+                    try:
+                        await asyncio.to_thread(existing_path.rename, target_path)
+                    except Exception as e:
+                        print(f"Failed to rename {existing_path} -> {target_path}: {e}")
+                        continue
+                    # Queue the document update for this filename; flushed in batches below
+                    ops.append(UpdateOne(
                         {"site_id": site_id, "categories.category": cat_key, "categories.images.filename": existing_fname},
                         {"$set": {"categories.$[c].images.$[i].filename": target_path.name}},
                         array_filters=[{"c.category": cat_key}, {"i.filename": existing_fname}]
-                    )
-                    renamed += 1
-                    print(f"Renamed {existing_fname} -> {target_path.name}")
-                except Exception as e:
-                    print(f"Failed to rename {existing_path} -> {target_path}: {e}")
+                    ))
+                    pending.append((existing_path, target_path))
+                    if len(ops) >= BULK_BATCH_SIZE:
+                        renamed += await flush_renames(db, ops, pending)
+                        ops = []
+                        pending = []
+        finally:
+            # Always write updates for files already renamed, even if this site failed
+            renamed += await flush_renames(db, ops, pending)
+    return total, renamed
+
+
+async def main():
+    client = AsyncIOMotorClient(MONGO_URL, maxPoolSize=MONGO_POOL_SIZE, w=1)
+    db = client[DB_NAME]
+    sites = await db.sites.find({}).to_list(None)
+    naming_cfg = await db.naming_format.find_one({}, {"_id": 0})
+    format_str = naming_cfg.get('format') if naming_cfg else '{site_id}_{category}_{component_name}'
+    # Display category names don't change during the run; fetch them once
+    cat_doc = await db.category_names.find_one({}, {"_id": 0})
+    if cat_doc and isinstance(cat_doc.get('categories', {}), dict):
+        category_names_map = cat_doc.get('categories') or {}
+    else:
+        category_names_map = {}
+
+    # Sites live in separate directories and documents, so they can be processed concurrently
+    sem = asyncio.Semaphore(SITE_CONCURRENCY)
+    # return_exceptions keeps one failing site from cancelling the others mid-rename
+    try:
+        results = await asyncio.gather(*(
+            process_site(db, site, format_str, category_names_map, sem) for site in sites
+        ), return_exceptions=True)
+    finally:
+        client.close()
+
+    total = 0
+    renamed = 0
+    failed_sites = []
+    for site, result in zip(sites, results):
+        if isinstance(result, BaseException):
+            failed_sites.append((site.get('site_id'), result))
+            continue
+        total += result[0]
+        renamed += result[1]
 
     print(f"Processed {total} images, renamed {renamed} files")
+    if failed_sites:
+        print(f"{len(failed_sites)} site(s) failed and should be re-run:")
+        for site_id, exc in failed_sites:
+            print(f"  {site_id}: {exc!r}")
 
 
 if __name__ == '__main__':
-    main()
+    asyncio.run(main())
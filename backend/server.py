@@ -1,20 +1,25 @@
-from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from pymongo.errors import AutoReconnect
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict
+from pydantic import BaseModel
 from typing import List, Optional, Dict, Iterable
 from datetime import datetime, timezone
+from urllib.parse import quote
+import asyncio
+import hashlib
+import io
 import os
-import uuid
-import re
-import aiofiles
+import shutil
 import zipfile
 import logging
 import tempfile
+import time
 from contextlib import asynccontextmanager
 
 ROOT_DIR = Path(__file__).parent
@@ -36,7 +41,18 @@ mongo_url = mongo_url.strip()
 if (mongo_url.startswith('"') and mongo_url.endswith('"')) or (mongo_url.startswith("'") and mongo_url.endswith("'")):
     mongo_url = mongo_url[1:-1]
 
-client = AsyncIOMotorClient(mongo_url, serverSelectionTimeoutMS=5000)
+# Connection pool settings (can be tuned via env); shared by every client we create.
+# No idle connections are kept by default (serverless instances would each hold
+# them), and the minimum is clamped so a low MONGO_POOL_MAX can't stop startup.
+MONGO_POOL_MAX = int(os.environ.get('MONGO_POOL_MAX', 50))
+MONGO_POOL_MIN = min(int(os.environ.get('MONGO_POOL_MIN', 0)), MONGO_POOL_MAX)
+MONGO_CLIENT_OPTIONS = {
+    'maxPoolSize': MONGO_POOL_MAX,
+    'minPoolSize': MONGO_POOL_MIN,
+    'serverSelectionTimeoutMS': 5000,
+}
+
+client = AsyncIOMotorClient(mongo_url, **MONGO_CLIENT_OPTIONS)
 
 # Read and sanitize DB_NAME
 raw_db_name = os.environ.get('DB_NAME', 'site_renamer')
@@ -51,9 +67,15 @@ if '"' in db_name or "'" in db_name:
     raise RuntimeError(f"DB_NAME contains invalid quote characters after sanitization: {db_name!r}. Remove quotes from the environment variable.")
 
 db = client[db_name]
+# Event loop the Motor client is bound to; set once the app starts serving
+_client_loop = None
 
 # Production / operational settings (can be tuned via env)
 MAX_UPLOAD_SIZE = int(os.environ.get('MAX_UPLOAD_SIZE', 10 * 1024 * 1024))  # 10 MiB default
+# Read/write size used when copying an upload from its spooled temp file to disk
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 80 * 1024))  # 80 KiB default
+# Seconds the naming format / category names are cached in process memory
+CONFIG_CACHE_TTL = float(os.environ.get('CONFIG_CACHE_TTL', 30))
 ALLOWED_EXTENSIONS = set(x.lower() for x in os.environ.get('ALLOWED_EXTENSIONS', '.jpg,.jpeg,.png,.gif,.bmp,.tiff').split(','))
 
 # Parse CORS origins (comma-separated). Empty or '*' => allow all
@@ -64,23 +86,68 @@ if raw_cors.strip() == '*' or raw_cors.strip() == '':
 else:
     CORS_ORIGINS = [o.strip() for o in raw_cors.split(',') if o.strip()]
 
+def _config_filter(collection) -> dict:
+    """Filter for the single config document kept in `collection`.
+
+    Config collections hold exactly one row under a fixed _id, so upserts are
+    idempotent and can't accumulate duplicates under concurrent writes.
+    """
+    return {"_id": f"{collection.name}:singleton"}
+
+
+async def _adopt_legacy_config(collection):
+    """Move a config row stored under a random _id (older releases) to the singleton _id"""
+    singleton = _config_filter(collection)
+    if await collection.find_one(singleton, {"_id": 1}):
+        return
+    legacy = await collection.find_one({}, {"_id": 0})
+    if legacy:
+        await collection.update_one(singleton, {"$setOnInsert": legacy}, upsert=True)
+        await collection.delete_many({"_id": {"$ne": singleton["_id"]}})
+        logger.info("Migrated %s config to singleton document", collection.name)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    global _client_loop
     # Verify DB connection and prepare indexes at startup
     try:
         await client.admin.command("ping")
         logger.info("Connected to MongoDB (%s)", db_name)
+        _client_loop = asyncio.get_running_loop()
         # Ensure an index on site_id exists for quick lookups (idempotent)
         try:
             await db.sites.create_index("site_id", unique=True)
             logger.info("Ensured index on sites.site_id")
         except Exception:
             logger.exception("Could not create index on sites.site_id (may already exist or insufficient permissions)")
+        # Compound/multikey indexes backing the positional category and filename updates
+        try:
+            await db.sites.create_index([("site_id", 1), ("categories.category", 1)])
+            await db.sites.create_index("categories.images.filename")
+            logger.info("Ensured indexes on sites.categories.category and sites.categories.images.filename")
+        except Exception:
+            logger.exception("Could not create secondary indexes on sites (may already exist or insufficient permissions)")
+        for name in ('component_names', 'category_names', 'naming_format'):
+            try:
+                await _adopt_legacy_config(db[name])
+            except Exception:
+                logger.exception("Could not migrate %s config to singleton document", name)
     except Exception as e:
         logger.exception("Failed to connect to MongoDB: %s", e)
         # re-raise to stop startup
         raise
 
+    # Downloads are streamed now; remove site archives left behind by older releases,
+    # which would otherwise sit on disk and stay reachable under /uploads.
+    for stale_zip in UPLOADS_DIR.glob('*.zip'):
+        if not stale_zip.is_file():
+            continue
+        try:
+            stale_zip.unlink()
+        except OSError:
+            logger.warning("Could not remove stale archive %s", stale_zip)
+
     # Detect running on Vercel (serverless) where filesystem is ephemeral
     vercel_detected = bool(os.environ.get('VERCEL') or os.environ.get('VERCEL_URL') or os.environ.get('VERCEL_ENV') or os.environ.get('NOW_REGION'))
     if vercel_detected:
@@ -92,35 +159,54 @@ async def lifespan(app: FastAPI):
         # Clean shutdown
         client.close()
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 api_router = APIRouter(prefix="/api")
 
 
+def _reset_mongo_client():
+    """Recreate the global `client` and `db` bound to the current event loop"""
+    global client, db, _client_loop
+    try:
+        client.close()
+    except Exception:
+        pass
+    client = AsyncIOMotorClient(mongo_url, **MONGO_CLIENT_OPTIONS)
+    db = client[db_name]
+    _client_loop = asyncio.get_running_loop()
+
+
 @app.middleware("http")
 async def ensure_mongo_client_middleware(request, call_next):
     """Middleware to make the Motor client resilient in serverless environments.
 
     Some serverless invocations reuse process state where an AsyncIOMotorClient
-    may be bound to a previous/closed event loop. This middleware pings the
-    client and on failure recreates the global `client` and `db` objects so
-    handlers can continue to use the `db` variable defined at module level.
+    may be bound to a previous/closed event loop. Rather than pinging MongoDB on
+    every request, this only recreates the global `client` and `db` objects when
+    the running event loop is not the one the client was bound to.
     """
-    global client, db
-    try:
-        # quick ping; if it raises we'll recreate the client
-        await client.admin.command("ping")
-    except Exception as e:
-        logger.warning("MongoDB ping failed in middleware (%s). Recreating client.", e)
-        try:
-            client.close()
-        except Exception:
-            pass
-        # Recreate client bound to the current event loop
-        client = AsyncIOMotorClient(mongo_url, serverSelectionTimeoutMS=5000)
-        db = client[db_name]
+    global _client_loop
+    loop = asyncio.get_running_loop()
+    if _client_loop is None:
+        _client_loop = loop
+    elif _client_loop is not loop:
+        logger.warning("Event loop changed since MongoDB client was created. Recreating client.")
+        _reset_mongo_client()
     response = await call_next(request)
     return response
 
+
+@app.exception_handler(AutoReconnect)
+async def mongo_unavailable_handler(request, exc):
+    """Answer 503 when MongoDB is unreachable or failing over.
+
+    Covers ServerSelectionTimeoutError and NotPrimaryError, which subclass
+    AutoReconnect. The shared client is left alone: Motor reconnects by itself,
+    and closing it would also fail other in-flight requests. The request isn't
+    replayed since uploads have already consumed their body.
+    """
+    logger.warning("MongoDB unavailable (%s)", exc)
+    return ORJSONResponse(status_code=503, content={"detail": "Database temporarily unavailable, please retry"})
+
 # Create uploads directory
 VERCEL_DETECTED = bool(os.environ.get('VERCEL') or os.environ.get('VERCEL_URL') or os.environ.get('VERCEL_ENV') or os.environ.get('NOW_REGION'))
 
@@ -133,49 +219,18 @@ else:
 UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
 
 # Models
-class ComponentNames(BaseModel):
-    model_config = ConfigDict(extra="ignore")
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    names: List[str]
-    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-
 class ComponentNamesUpdate(BaseModel):
     names: List[str]
 
-class CategoryNames(BaseModel):
-    model_config = ConfigDict(extra="ignore")
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    categories: Dict[str, str] = {"alpha": "Alpha", "beta": "Beta", "gamma": "Gamma"}
-    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-
 class CategoryNamesUpdate(BaseModel):
     categories: Dict[str, str]
 
-class NamingFormat(BaseModel):
-    model_config = ConfigDict(extra="ignore")
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    format: str = "{site_id}_{category}_{component_name}"
-    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-
 class NamingFormatUpdate(BaseModel):
     format: str
 
-class UploadedImage(BaseModel):
-    component_name: str
-    filename: str
-    uploaded_at: str
-
-class SiteCategory(BaseModel):
-    category: str
-    images: List[UploadedImage]
-
-class Site(BaseModel):
-    model_config = ConfigDict(extra="ignore")
-    site_id: str
-    categories: List[SiteCategory] = []
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+# Site categories accepted by the upload endpoint
+_VALID_CATEGORIES = frozenset({"alpha", "beta", "gamma"})
 
 # Defaults
 DEFAULT_COMPONENT_NAMES = [
@@ -195,22 +250,35 @@ DEFAULT_COMPONENT_NAMES = [
 ]
 
 
+def _ascii_table(allowed: bytes) -> bytes:
+    """Build a bytes.translate table that maps every byte not in `allowed` to '_'"""
+    allowed_set = set(allowed)
+    return bytes(c if c in allowed_set else ord('_') for c in range(256))
+
+
+_ALNUM = b'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+# Allowed characters in generated names (spaces are kept) / in filenames.
+# Non-ASCII characters are encoded as '?' first, which the tables map to '_'.
+_NAME_TABLE = _ascii_table(_ALNUM + b'_- ')
+_FNAME_TABLE = _ascii_table(_ALNUM + b' ._-')
+# site_id/category are compacted: spaces (and slashes) become underscores
+_COMPACT_TRANS = str.maketrans({' ': '_', '/': '_'})
+
+
 def apply_naming_format(format_str: str, site_id: str, category: str, component_name: str) -> str:
     """Apply the naming format with the provided values"""
     # For filenames we want to preserve spaces inside component names (per UX request)
     # but keep site_id and category compact (replace spaces with underscores).
-    safe_site_id = site_id.replace(' ', '_')
-    safe_category = category.replace(' ', '_').replace('/', '_')
-    # For component names: keep spaces but normalize slashes; other disallowed
-    # characters will be replaced below while allowing spaces to remain.
-    safe_component = component_name.replace('/', '_')
-
+    safe_site_id = site_id.translate(_COMPACT_TRANS)
+    safe_category = category.translate(_COMPACT_TRANS)
+    # Component names keep their spaces; slashes and other disallowed characters
+    # are replaced by the final translate below.
     result = format_str.replace('{site_id}', safe_site_id)
     result = result.replace('{category}', safe_category)
-    result = result.replace('{component_name}', safe_component)
+    result = result.replace('{component_name}', component_name)
     # Replace any remaining disallowed characters with underscores, but allow spaces
     # so component names keep their spaces.
-    result = re.sub(r'[^a-zA-Z0-9_\- ]', '_', result)
+    result = result.encode('ascii', 'replace').translate(_NAME_TABLE).decode('ascii')
     return result
 
 
@@ -219,13 +287,185 @@ def _sanitize_filename(name: str) -> str:
     name = os.path.basename(name)
     # Allow spaces in filenames so component names can retain spaces.
     # Replace other disallowed characters with underscore.
-    name = re.sub(r'[^a-zA-Z0-9 ._-]', '_', name)
+    name = name.encode('ascii', 'replace').translate(_FNAME_TABLE).decode('ascii')
     # Prevent names starting with dot
     if name.startswith('.'):
         name = name.lstrip('.')
     return name or 'file'
 
 
+# In-process cache of config documents that rarely change: name -> (loaded_at, value).
+# The PUT handlers pop their entry so updates are visible immediately on this process.
+_config_cache: Dict[str, tuple] = {}
+
+
+async def _get_cached(name: str, loader, ttl: float = CONFIG_CACHE_TTL):
+    """Return the cached result of `loader()` for `name`, reloading it after `ttl` seconds"""
+    now = time.monotonic()
+    hit = _config_cache.get(name)
+    if hit is not None and now - hit[0] < ttl:
+        return hit[1]
+    value = await loader()
+    _config_cache[name] = (now, value)
+    return value
+
+
+async def _get_config(collection_name: str) -> Optional[dict]:
+    """Return the singleton config document of `collection_name` (or None), cached.
+
+    The returned dict is shared between requests and must not be mutated.
+    """
+    collection = db[collection_name]
+    return await _get_cached(
+        collection_name,
+        lambda: collection.find_one(_config_filter(collection), {"_id": 0})
+    )
+
+
+async def _cached_naming_format() -> str:
+    """Return the configured naming format"""
+    naming_config = await _get_config('naming_format')
+    return naming_config.get('format', "{site_id}_{category}_{component_name}") if naming_config else "{site_id}_{category}_{component_name}"
+
+
+async def _cached_category_names() -> Dict[str, str]:
+    """Return the configured category key -> display name map (empty if unset)"""
+    category_config = await _get_config('category_names')
+    if category_config and isinstance(category_config.get('categories', {}), dict):
+        return category_config.get('categories', {})
+    return {}
+
+
+# Upload folders already created by this process, so the hot path skips mkdir
+_created_dirs: set = set()
+
+
+def _write_upload_sync(src, file_path: Path, max_size: int, size: Optional[int] = None) -> bool:
+    """Copy an upload to `file_path` in one worker thread.
+
+    `size` is the length Starlette recorded while spooling the upload, if known.
+    Returns False (and removes any partial file) if the upload exceeds `max_size`.
+    """
+    if size is not None and size > max_size:
+        # Known to be too large: don't write anything
+        return False
+    try:
+        out_file = open(file_path, 'wb', buffering=UPLOAD_CHUNK_SIZE)
+    except FileNotFoundError:
+        # The folder was removed after it was recorded in _created_dirs
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        out_file = open(file_path, 'wb', buffering=UPLOAD_CHUNK_SIZE)
+    total_written = 0
+    with out_file:
+        if size is not None:
+            # Size already checked, so no per-chunk accounting is needed
+            shutil.copyfileobj(src, out_file, UPLOAD_CHUNK_SIZE)
+            return True
+        while True:
+            chunk = src.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            total_written += len(chunk)
+            if total_written > max_size:
+                break
+            out_file.write(chunk)
+    if total_written > max_size:
+        # cleanup partial file
+        try:
+            file_path.unlink()
+        except Exception:
+            pass
+        return False
+    return True
+
+
+def _list_files(directory) -> set:
+    """Names of the regular files directly inside `directory` (empty if it doesn't exist)"""
+    try:
+        with os.scandir(directory) as it:
+            return {entry.name for entry in it if entry.is_file(follow_symlinks=False)}
+    except OSError:
+        return set()
+
+
+def _scan_files(root):
+    """Yield paths of regular files under `root`, recursing with os.scandir"""
+    with os.scandir(root) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _scan_files(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry.path
+
+
+# Read size used when copying image bytes into a streamed ZIP
+ZIP_CHUNK_SIZE = 256 * 1024
+
+
+class _ZipStreamSink(io.RawIOBase):
+    """Unseekable write-only buffer that ZipFile writes into while we drain it.
+
+    Because it can't seek, ZipFile falls back to data descriptors, so entries can
+    be emitted without knowing their size up front. Writes are kept as a list of
+    the bytes objects ZipFile hands over; for stored entries those are the chunks
+    read from disk, so file data reaches the response without being copied again.
+    """
+
+    def __init__(self):
+        self._parts = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        # bytes(b) is a no-op for bytes; it only copies views/bytearrays
+        self._parts.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        # join() returns a lone bytes part as-is, without copying
+        data = b''.join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def _iter_zip(entries: List[tuple]):
+    """Yield a ZIP archive of `(file_path, arcname)` entries chunk by chunk.
+
+    Image formats are already compressed, so those entries are stored; deflate
+    is only spent on anything else that ends up in the site folder.
+    """
+    sink = _ZipStreamSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as zipf:
+        for file_path, arcname in entries:
+            # Entries are listed before streaming starts, so an image can be
+            # deleted or replaced in the meantime; skip it rather than truncate
+            # the archive. Once open, the descriptor stays valid even if unlinked.
+            try:
+                src = open(file_path, 'rb')
+            except FileNotFoundError:
+                continue
+            with src:
+                st = os.fstat(src.fileno())
+                zinfo = zipfile.ZipInfo(str(arcname), time.localtime(st.st_mtime)[:6])
+                zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+                zinfo.file_size = st.st_size
+                if Path(file_path).suffix.lower() in ALLOWED_EXTENSIONS:
+                    zinfo.compress_type = zipfile.ZIP_STORED
+                else:
+                    zinfo.compress_type = zipfile.ZIP_DEFLATED
+                with zipf.open(zinfo, 'w') as dest:
+                    while True:
+                        chunk = src.read(ZIP_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        dest.write(chunk)
+                        yield sink.drain()
+            yield sink.drain()
+    # Central directory is written when the archive is closed
+    yield sink.drain()
+
+
 @api_router.get("/")
 async def root():
     return {"message": "Antenna Site Image Sorter API"}
@@ -233,12 +473,11 @@ async def root():
 
 @api_router.get("/component-names")
 async def get_component_names():
-    config = await db.component_names.find_one({}, {"_id": 0})
+    config = await _get_config('component_names')
     if not config:
-        config_obj = ComponentNames(names=DEFAULT_COMPONENT_NAMES)
-        doc = config_obj.model_dump()
-        doc['updated_at'] = doc['updated_at'].isoformat()
-        await db.component_names.insert_one(doc)
+        doc = {"names": DEFAULT_COMPONENT_NAMES, "updated_at": datetime.now(timezone.utc).isoformat()}
+        await db.component_names.update_one(_config_filter(db.component_names), {"$setOnInsert": doc}, upsert=True)
+        _config_cache.pop('component_names', None)
         return {"names": DEFAULT_COMPONENT_NAMES}
     return {"names": config.get('names', DEFAULT_COMPONENT_NAMES)}
 
@@ -247,44 +486,38 @@ async def get_component_names():
 async def update_component_names(input: ComponentNamesUpdate):
     if len(input.names) < 1:
         raise HTTPException(status_code=400, detail="Must provide at least 1 component name")
-    config_obj = ComponentNames(names=input.names)
-    doc = config_obj.model_dump()
-    doc['updated_at'] = doc['updated_at'].isoformat()
-    await db.component_names.delete_many({})
-    await db.component_names.insert_one(doc)
+    doc = {"names": input.names, "updated_at": datetime.now(timezone.utc).isoformat()}
+    await db.component_names.replace_one(_config_filter(db.component_names), doc, upsert=True)
+    _config_cache.pop('component_names', None)
     return {"names": input.names, "message": "Component names updated successfully"}
 
 
 @api_router.get("/category-names")
 async def get_category_names():
-    config = await db.category_names.find_one({}, {"_id": 0})
+    config = await _get_config('category_names')
     if not config:
-        config_obj = CategoryNames()
-        doc = config_obj.model_dump()
-        doc['updated_at'] = doc['updated_at'].isoformat()
-        await db.category_names.insert_one(doc)
+        doc = {"categories": {"alpha": "Alpha", "beta": "Beta", "gamma": "Gamma"}, "updated_at": datetime.now(timezone.utc).isoformat()}
+        await db.category_names.update_one(_config_filter(db.category_names), {"$setOnInsert": doc}, upsert=True)
+        _config_cache.pop('category_names', None)
         return {"categories": {"alpha": "Alpha", "beta": "Beta", "gamma": "Gamma"}}
     return {"categories": config.get('categories', {"alpha": "Alpha", "beta": "Beta", "gamma": "Gamma"})}
 
 
 @api_router.put("/category-names")
 async def update_category_names(input: CategoryNamesUpdate):
-    config_obj = CategoryNames(categories=input.categories)
-    doc = config_obj.model_dump()
-    doc['updated_at'] = doc['updated_at'].isoformat()
-    await db.category_names.delete_many({})
-    await db.category_names.insert_one(doc)
+    doc = {"categories": input.categories, "updated_at": datetime.now(timezone.utc).isoformat()}
+    await db.category_names.replace_one(_config_filter(db.category_names), doc, upsert=True)
+    _config_cache.pop('category_names', None)
     return {"categories": input.categories, "message": "Category names updated successfully"}
 
 
 @api_router.get("/naming-format")
 async def get_naming_format():
-    config = await db.naming_format.find_one({}, {"_id": 0})
+    config = await _get_config('naming_format')
     if not config:
-        config_obj = NamingFormat()
-        doc = config_obj.model_dump()
-        doc['updated_at'] = doc['updated_at'].isoformat()
-        await db.naming_format.insert_one(doc)
+        doc = {"format": "{site_id}_{category}_{component_name}", "updated_at": datetime.now(timezone.utc).isoformat()}
+        await db.naming_format.update_one(_config_filter(db.naming_format), {"$setOnInsert": doc}, upsert=True)
+        _config_cache.pop('naming_format', None)
         return {"format": "{site_id}_{category}_{component_name}"}
     return {"format": config.get('format', "{site_id}_{category}_{component_name}")}
 
@@ -293,14 +526,42 @@ async def get_naming_format():
 async def update_naming_format(input: NamingFormatUpdate):
     if not any(placeholder in input.format for placeholder in ['{site_id}', '{category}', '{component_name}']):
         raise HTTPException(status_code=400, detail="Format must contain at least one placeholder: {site_id}, {category}, or {component_name}")
-    config_obj = NamingFormat(format=input.format)
-    doc = config_obj.model_dump()
-    doc['updated_at'] = doc['updated_at'].isoformat()
-    await db.naming_format.delete_many({})
-    await db.naming_format.insert_one(doc)
+    doc = {"format": input.format, "updated_at": datetime.now(timezone.utc).isoformat()}
+    await db.naming_format.replace_one(_config_filter(db.naming_format), doc, upsert=True)
+    _config_cache.pop('naming_format', None)
     return {"format": input.format, "message": "Naming format updated successfully"}
 
 
+def _build_upsert_ops(site_id: str, category: str, uploaded_image: dict) -> List[UpdateOne]:
+    """Return the ordered updates that store `uploaded_image` under the site's category.
+
+    Creates the site and category when missing and replaces any earlier image of
+    the same component. A handler storing several uploads can concatenate the
+    lists and send them in a single ordered bulk_write.
+    """
+    now_iso = uploaded_image['uploaded_at']
+    in_category = {"site_id": site_id, "categories.category": category}
+    return [
+        UpdateOne(
+            {"site_id": site_id},
+            {"$setOnInsert": {"categories": [], "created_at": now_iso}},
+            upsert=True
+        ),
+        UpdateOne(
+            {"site_id": site_id, "categories.category": {"$ne": category}},
+            {"$push": {"categories": {"category": category, "images": []}}}
+        ),
+        UpdateOne(
+            in_category,
+            {"$pull": {"categories.$.images": {"component_name": uploaded_image['component_name']}}}
+        ),
+        UpdateOne(
+            in_category,
+            {"$push": {"categories.$.images": uploaded_image}, "$set": {"updated_at": now_iso}}
+        ),
+    ]
+
+
 @api_router.post("/sites/{site_id}/upload")
 async def upload_image(
     site_id: str,
@@ -308,82 +569,60 @@ async def upload_image(
     component_name: str,
     file: UploadFile = File(...)
 ):
-    if category.lower() not in ['alpha', 'beta', 'gamma']:
+    category_l = category.lower()
+    if category_l not in _VALID_CATEGORIES:
         raise HTTPException(status_code=400, detail="Category must be alpha, beta, or gamma")
-    naming_config = await db.naming_format.find_one({}, {"_id": 0})
-    format_str = naming_config.get('format', "{site_id}_{category}_{component_name}") if naming_config else "{site_id}_{category}_{component_name}"
-    site_dir = UPLOADS_DIR / site_id / category.lower()
-    site_dir.mkdir(parents=True, exist_ok=True)
+    format_str = await _cached_naming_format()
+    site_dir = UPLOADS_DIR / site_id / category_l
+    if site_dir not in _created_dirs:
+        await asyncio.to_thread(site_dir.mkdir, parents=True, exist_ok=True)
+        _created_dirs.add(site_dir)
     # sanitize incoming filename extension and generated name
     incoming_ext = Path(file.filename).suffix.lower()
     if incoming_ext not in ALLOWED_EXTENSIONS:
         raise HTTPException(status_code=400, detail=f"File type not allowed: {incoming_ext}")
     # Determine the display label for the category (if configured) and use that in file names.
     # The storage layout continues to use the lowercase category key.
-    category_config = await db.category_names.find_one({}, {"_id": 0})
-    if category_config and isinstance(category_config.get('categories', {}), dict):
-        display_category = category_config.get('categories', {}).get(category.lower(), category)
-    else:
-        display_category = category
+    display_category = (await _cached_category_names()).get(category_l, category)
 
     filename_without_ext = apply_naming_format(format_str, site_id, display_category, component_name)
     safe_filename_base = _sanitize_filename(filename_without_ext)
     new_filename = f"{safe_filename_base}{incoming_ext}"
     file_path = site_dir / new_filename
 
-    # Stream the upload to disk and enforce max size to avoid memory and disk exhaustion
-    total_written = 0
-    CHUNK = 64 * 1024
+    # Stream the upload to disk and enforce max size to avoid memory and disk exhaustion.
+    # The whole copy runs in a single worker thread rather than one hop per chunk.
     try:
-        async with aiofiles.open(file_path, 'wb') as out_file:
-            while True:
-                chunk = await file.read(CHUNK)
-                if not chunk:
-                    break
-                total_written += len(chunk)
-                if total_written > MAX_UPLOAD_SIZE:
-                    # cleanup partial file
-                    await out_file.close()
-                    try:
-                        file_path.unlink()
-                    except Exception:
-                        pass
-                    raise HTTPException(status_code=413, detail=f"File too large. Max {MAX_UPLOAD_SIZE} bytes")
-                await out_file.write(chunk)
+        within_limit = await asyncio.to_thread(_write_upload_sync, file.file, file_path, MAX_UPLOAD_SIZE, file.size)
     finally:
         await file.close()
-    site = await db.sites.find_one({"site_id": site_id}, {"_id": 0})
+    if not within_limit:
+        raise HTTPException(status_code=413, detail=f"File too large. Max {MAX_UPLOAD_SIZE} bytes")
+    # One timestamp for the image record and the site so they stay consistent
+    now_iso = datetime.now(timezone.utc).isoformat()
     uploaded_image = {
         "component_name": component_name,
         "filename": new_filename,
-        "uploaded_at": datetime.now(timezone.utc).isoformat()
+        "uploaded_at": now_iso
     }
-    if not site:
-        site_obj = Site(
-            site_id=site_id,
-            categories=[{
-                "category": category.lower(),
-                "images": [uploaded_image]
-            }]
-        )
-        doc = site_obj.model_dump()
-        doc['created_at'] = doc['created_at'].isoformat()
-        doc['updated_at'] = doc['updated_at'].isoformat()
-        await db.sites.insert_one(doc)
-    else:
-        category_found = False
-        for cat in site.get('categories', []):
-            if cat.get('category') == category.lower():
-                cat.setdefault('images', []).append(uploaded_image)
-                category_found = True
-                break
-        if not category_found:
-            site.setdefault('categories', []).append({
-                "category": category.lower(),
-                "images": [uploaded_image]
-            })
-        site['updated_at'] = datetime.now(timezone.utc).isoformat()
-        await db.sites.update_one({"site_id": site_id}, {"$set": {"categories": site['categories'], "updated_at": site['updated_at']}})
+    # A new upload replaces any previous image of the same component. Fetch just
+    # this category's images to know which files to remove from disk afterwards.
+    site = await db.sites.find_one(
+        {"site_id": site_id, "categories.category": category_l},
+        {"_id": 0, "categories.$": 1}
+    )
+    replaced = []
+    if site and site.get('categories'):
+        replaced = [img for img in site['categories'][0].get('images', []) if img.get('component_name') == component_name]
+    await db.sites.bulk_write(_build_upsert_ops(site_id, category_l, uploaded_image), ordered=True)
+    # Remove files of replaced images (unless the new upload overwrote the same name)
+    for img in replaced:
+        old_filename = img.get('filename')
+        if old_filename and old_filename != new_filename:
+            try:
+                (site_dir / old_filename).unlink()
+            except FileNotFoundError:
+                pass
     return {
         "message": "Image uploaded successfully",
         "filename": new_filename,
@@ -393,13 +632,14 @@ async def upload_image(
 
 @api_router.get("/sites/{site_id}/category/{category}")
 async def get_category_images(site_id: str, category: str):
-    site = await db.sites.find_one({"site_id": site_id}, {"_id": 0})
-    if not site:
+    # Positional projection: the server returns only the matching category
+    site = await db.sites.find_one(
+        {"site_id": site_id, "categories.category": category.lower()},
+        {"_id": 0, "categories.$": 1}
+    )
+    if not site or not site.get('categories'):
         return {"images": []}
-    for cat in site.get('categories', []):
-        if cat.get('category') == category.lower():
-            return {"images": cat.get('images', [])}
-    return {"images": []}
+    return {"images": site['categories'][0].get('images', [])}
 
 
 @api_router.delete("/sites/{site_id}/category/{category}/image/{filename}")
@@ -420,90 +660,99 @@ async def delete_image(site_id: str, category: str, filename: str):
     else:
         raise HTTPException(status_code=404, detail="Image file not found")
     
-    # Update MongoDB to remove the image from the category's images array
-    site = await db.sites.find_one({"site_id": site_id})
-    if not site:
-        raise HTTPException(status_code=404, detail="Site not found")
-    
-    updated = False
-    for cat in site.get('categories', []):
-        if cat.get('category') == category.lower():
-            images = cat.get('images', [])
-            # Remove the image entry matching the filename
-            updated_images = [img for img in images if img.get('filename') != filename]
-            if len(updated_images) < len(images):
-                cat['images'] = updated_images
-                updated = True
-            break
-    
-    if updated:
-        site['updated_at'] = datetime.now(timezone.utc).isoformat()
-        await db.sites.update_one(
-            {"site_id": site_id},
-            {"$set": {"categories": site['categories'], "updated_at": site['updated_at']}}
-        )
+    # Update MongoDB to remove the image from the category's images array. The
+    # $pull runs server-side, so the site document is never fetched in full.
+    result = await db.sites.update_one(
+        {"site_id": site_id, "categories": {"$elemMatch": {"category": category.lower(), "images.filename": filename}}},
+        {
+            "$pull": {"categories.$.images": {"filename": filename}},
+            "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
+        }
+    )
+    if result.matched_count:
         return {"message": "Image deleted successfully", "filename": filename}
+    if not await db.sites.find_one({"site_id": site_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Site not found")
+    raise HTTPException(status_code=404, detail="Image not found in database")
+
+
+def _collect_zip_entries(site_dir: Path, site_id: str, site: Optional[dict], format_str: str, categories_map: Dict[str, str]) -> List[tuple]:
+    """Return the `(file_path, arcname)` pairs to include in a site's ZIP"""
+    entries = []
+    if site:
+        # Iterate categories and images from metadata so we can compute archive names
+        for cat in site.get('categories', []):
+            cat_key = cat.get('category')
+            display_category = categories_map.get(cat_key, cat_key)
+            # One directory read per category instead of a stat per image
+            files_on_disk = _list_files(site_dir / cat_key)
+
+            for img in cat.get('images', []):
+                fname_on_disk = img.get('filename')
+                comp_name = img.get('component_name')
+                if fname_on_disk not in files_on_disk:
+                    # skip missing files
+                    continue
+                file_path = site_dir / cat_key / fname_on_disk
+                # Compute the desired archive filename using current naming format
+                expected_base = apply_naming_format(format_str, site_id, display_category, comp_name)
+                expected_safe = _sanitize_filename(expected_base) + Path(fname_on_disk).suffix
+                # ZIP structure: {site_id}/{site_id} {category}/images...
+                # e.g., "asdas/asdas -1/asdas_-1_Azimuth.png"
+                # Keep spaces in folder names, only replace slashes
+                safe_site_id = site_id.replace('/', '_')
+                safe_display_category = str(display_category).replace('/', '_')
+                arcname = Path(safe_site_id) / f"{safe_site_id} {safe_display_category}" / expected_safe
+                entries.append((file_path, arcname))
     else:
-        raise HTTPException(status_code=404, detail="Image not found in database")
+        # Fallback: include all files on disk in their current layout
+        safe_site_id = site_id.replace('/', '_')
+        for full in _scan_files(site_dir):
+            rel_path = os.path.relpath(full, site_dir)
+            arcname = Path(safe_site_id) / rel_path
+            entries.append((full, arcname))
+    return entries
 
 
 @api_router.get("/sites/{site_id}/download")
-async def download_site_images(site_id: str):
+async def download_site_images(site_id: str, request: Request):
     site_dir = UPLOADS_DIR / site_id
     if not site_dir.exists():
         raise HTTPException(status_code=404, detail="Site not found or no uploads")
-    zip_path = UPLOADS_DIR / f"{site_id}.zip"
-    # Overwrite if exists
-    if zip_path.exists():
-        zip_path.unlink()
     # Build the ZIP using the site's metadata so filenames in the archive reflect
     # the current naming format and display category names (even if stored files
     # on disk used older naming rules).
-    naming_cfg = await db.naming_format.find_one({}, {"_id": 0})
-    format_str = naming_cfg.get('format', "{site_id}_{category}_{component_name}") if naming_cfg else "{site_id}_{category}_{component_name}"
+    format_str = await _cached_naming_format()
+    categories_map = await _cached_category_names()
     site = await db.sites.find_one({"site_id": site_id}, {"_id": 0})
-    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        if site:
-            # Iterate categories and images from metadata so we can compute archive names
-            for cat in site.get('categories', []):
-                cat_key = cat.get('category')
-                # Determine display category if configured
-                category_config = await db.category_names.find_one({}, {"_id": 0})
-                if category_config and isinstance(category_config.get('categories', {}), dict):
-                    display_category = category_config.get('categories', {}).get(cat_key, cat_key)
-                else:
-                    display_category = cat_key
-
-                for img in cat.get('images', []):
-                    fname_on_disk = img.get('filename')
-                    comp_name = img.get('component_name')
-                    file_path = site_dir / cat_key / fname_on_disk
-                    # Compute the desired archive filename using current naming format
-                    expected_base = apply_naming_format(format_str, site_id, display_category, comp_name)
-                    expected_safe = _sanitize_filename(expected_base) + Path(fname_on_disk).suffix
-                    # ZIP structure: {site_id}/{site_id} {category}/images...
-                    # e.g., "asdas/asdas -1/asdas_-1_Azimuth.png"
-                    # Keep spaces in folder names, only replace slashes
-                    safe_site_id = site_id.replace('/', '_')
-                    safe_display_category = str(display_category).replace('/', '_')
-                    arcname = Path(safe_site_id) / f"{safe_site_id} {safe_display_category}" / expected_safe
-                    if not file_path.exists():
-                        # skip missing files
-                        continue
-                    zipf.write(file_path, arcname)
-        else:
-            # Fallback: include all files on disk in their current layout
-            safe_site_id = site_id.replace('/', '_')
-            for root, _, files in os.walk(site_dir):
-                for fname in files:
-                    full = Path(root) / fname
-                    rel_path = full.relative_to(site_dir)
-                    arcname = Path(safe_site_id) / rel_path
-                    zipf.write(full, arcname)
-    return FileResponse(
-        path=zip_path,
-        filename=f"{site_id}_images.zip",
-        media_type='application/zip'
+    # The archive only changes when the site's images or the naming config change,
+    # so let clients revalidate a previous download instead of rebuilding it.
+    etag = None
+    if site:
+        etag_src = f"{site.get('updated_at')}|{format_str}|{sorted(categories_map.items())}"
+        etag = f'"{hashlib.sha1(etag_src.encode()).hexdigest()}"'
+        if_none_match = request.headers.get('if-none-match', '')
+        if etag in (tag.strip() for tag in if_none_match.split(',')):
+            return Response(status_code=304, headers={'ETag': etag})
+    # Checking files on disk is blocking, so collect the entries in a worker thread.
+    # The archive itself is produced by a sync generator, which StreamingResponse
+    # already drains in the threadpool.
+    entries = await asyncio.to_thread(_collect_zip_entries, site_dir, site_id, site, format_str, categories_map)
+
+    # Stream the archive straight to the client instead of writing it to disk first
+    download_name = f"{site_id}_images.zip"
+    quoted_name = quote(download_name)
+    if quoted_name != download_name:
+        content_disposition = f"attachment; filename*=utf-8''{quoted_name}"
+    else:
+        content_disposition = f'attachment; filename="{download_name}"'
+    headers = {'Content-Disposition': content_disposition}
+    if etag:
+        headers['ETag'] = etag
+    return StreamingResponse(
+        _iter_zip(entries),
+        media_type='application/zip',
+        headers=headers
     )
 
 
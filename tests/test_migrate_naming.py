@@ -0,0 +1,48 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# The migration script aborts at import without MONGO_URL; no connection is made.
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+import migrate_fix_component_spaces as migrate  # noqa: E402
+
+
+def full_render(format_str, site_id, category, component_name):
+    return migrate._sanitize_filename(
+        migrate.apply_naming_format(format_str, site_id, category, component_name)
+    )
+
+
+@pytest.mark.parametrize("format_str,site_id,category,component_name", [
+    ("{site_id}_{category}_{component_name}", "site 1", "Alpha", "Tower Photo"),
+    ("{site_id}_{category}_{component_name}", "a/b", "Beta/2", "CPRI Termination At A6"),
+    ("{site_id}_{category}_{component_name}", "s", "_COMP", "Tilt"),
+    ("{site_id}{component_name}", "a__COMP_", "Alpha", "Tilt"),
+    ("{site_id}_{category}_{component_name}", "s1", "Gamma", "Café Ñandú 日本"),
+    ("{site_id}_{category}_{component_name}", "s1", "Gamma", ""),
+    ("{component_name}", "s1", "Alpha", ".hidden"),
+    ("{site_id}_{category}", "s1", "Alpha", "Tilt"),
+    ("{component_name}_{component_name}", "s1", "Alpha", "Tilt"),
+])
+def test_fast_path_matches_full_render(format_str, site_id, category, component_name):
+    name_parts = migrate.split_naming_format(format_str, site_id, category)
+    if name_parts is None:
+        # Caller falls back to full rendering; nothing to compare
+        return
+    assert migrate.render_from_parts(name_parts, component_name) == full_render(
+        format_str, site_id, category, component_name
+    )
+
+
+def test_sentinel_overlap_falls_back():
+    assert migrate.split_naming_format("{site_id}{component_name}", "a__COMP_", "Alpha") is None
+    assert migrate.split_naming_format("{site_id}_{category}_{component_name}", "s", "_COMP") is None
+
+
+def test_formats_without_single_component_fall_back():
+    assert migrate.split_naming_format("{site_id}_{category}", "s1", "Alpha") is None
+    assert migrate.split_naming_format("{component_name}_{component_name}", "s1", "Alpha") is None